@@ -2,14 +2,18 @@ from __future__ import annotations
 
 import json
 import os
+import re
 import sys
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from crebain_client import CrebainClient, ApiError
 
 # Crebain API — Client Integration Example (Python)
@@ -41,6 +45,9 @@ SUPABASE_ANON_KEY = ""  # Set via environment variable or replace with your Supa
 # Configuration 
 # =============================================================================
 
+_WS = re.compile(r"[ \t\r\n]")
+
+
 @dataclass(frozen=True)
 class Config:
     api_key: str
@@ -48,6 +55,7 @@ class Config:
     supabase_anon_key: str
     download_dir: str = "downloads"
     timeout_seconds: int = 30
+    download_concurrency: int = 8
 
     @staticmethod
     def load() -> "Config":
@@ -65,7 +73,7 @@ class Config:
                 f"Fix:\n"
                 f'  export CREBAIN_API_KEY="ck_live_your_key_here"'
             )
-        if any(c in api_key for c in " \t\r\n"):
+        if _WS.search(api_key):
             raise ValueError(
                 f"Invalid CREBAIN_API_KEY: contains whitespace/newlines.\n"
                 f"Got: {repr(api_key[:80])}...\n\n"
@@ -84,7 +92,7 @@ class Config:
                 f"Fix:\n"
                 f'  export CREBAIN_BASE_URL="https://<project>.supabase.co/functions/v1/api"'
             )
-        if any(c in base_url for c in " \t\r\n"):
+        if _WS.search(base_url):
             raise ValueError(
                 f"Invalid CREBAIN_BASE_URL: contains whitespace/newlines.\n"
                 f"Got: {repr(base_url[:80])}...\n\n"
@@ -98,6 +106,7 @@ class Config:
             supabase_anon_key=supabase_anon_key,
             download_dir=os.getenv("CREBAIN_DOWNLOAD_DIR", "downloads"),
             timeout_seconds=int(os.getenv("CREBAIN_TIMEOUT_SECONDS", "30")),
+            download_concurrency=int(os.getenv("CREBAIN_DOWNLOAD_CONCURRENCY", "8")),
         )
 
 
@@ -109,6 +118,10 @@ logging.basicConfig(
     level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
 )
+# The format above never uses thread/process fields, so skip collecting them per record.
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 logger = logging.getLogger("crebain_client_example")
 
 
@@ -116,6 +129,9 @@ logger = logging.getLogger("crebain_client_example")
 # Helpers
 # =============================================================================
 
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+
 def safe_filename_from_url(url: str, fallback: str) -> str:
     try:
         name = os.path.basename(urlparse(url).path)
@@ -124,7 +140,118 @@ def safe_filename_from_url(url: str, fallback: str) -> str:
         return fallback
 
 
-def download_signed_files(files: list, out_dir: str, timeout_seconds: int) -> None:
+def _first_attr(obj, *names: str, default=None):
+    """Return the first truthy attribute of `obj` among `names`, like an `or` chain of getattr()s."""
+    for name in names:
+        value = getattr(obj, name, None)
+        if value:
+            return value
+    return default
+
+
+@dataclass(frozen=True)
+class FileView:
+    """File attributes resolved once, shared by the STEP 2 listing and the downloads."""
+    file_id: str
+    filename: str | None
+    mime_type: str
+    signed_url: str | None
+    size: int | None
+
+    @staticmethod
+    def of(f) -> "FileView":
+        return FileView(
+            file_id=_first_attr(f, "file_id", "id", default="unknown"),
+            filename=_first_attr(f, "filename", "name"),
+            mime_type=_first_attr(f, "mime_type", default="unknown"),
+            signed_url=_first_attr(f, "signed_url", "download_url"),
+            size=_first_attr(f, "bytes"),
+        )
+
+
+def make_download_session() -> requests.Session:
+    """
+    Shared session for signed-URL downloads.
+
+    Signed URLs usually all point at the same storage host, so keep-alive
+    connections are reused across files instead of paying a fresh TCP + TLS
+    handshake per download.
+    """
+    session = requests.Session()
+    # Transient CDN errors are retried on the pooled connection instead of
+    # failing the file. raise_on_status=False hands the last response back
+    # so a persistent failure is still logged with its HTTP status.
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry)
+    session.mount("https://", adapter)
+    return session
+
+
+def _copy_stream(src, dst, length: int = DOWNLOAD_CHUNK_SIZE) -> int:
+    """Like shutil.copyfileobj, but returns the number of bytes copied."""
+    written = 0
+    while chunk := src.read(length):
+        dst.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def _download_one(
+    session: requests.Session,
+    signed_url: str,
+    filename: str,
+    size: int | None,
+    out_path: Path,
+    timeout_seconds: int,
+) -> None:
+    destination = out_path / filename
+
+    # Only trust an existing file when it matches the size the API reports; a
+    # partial or stale file with the same name is downloaded again.
+    if size is not None:
+        try:
+            if destination.stat().st_size == size:
+                logger.info("⏭️  Skipping %s (already downloaded).", filename)
+                return
+        except FileNotFoundError:
+            pass
+
+    tmp = destination.with_name(destination.name + ".part")
+    logger.info("➡️  GET %s", signed_url)
+
+    try:
+        with session.get(signed_url, stream=True, timeout=timeout_seconds) as resp:
+            if resp.status_code != 200:
+                logger.error("❌ Download failed for %s (HTTP %s).", filename, resp.status_code)
+                return
+
+            # Copy straight from the raw stream; decode_content keeps gzip/deflate
+            # transfer encodings transparent, as iter_content() did.
+            resp.raw.decode_content = True
+            with tmp.open("wb") as fp:
+                written = _copy_stream(resp.raw, fp)
+
+        os.replace(tmp, destination)
+        logger.info("✅ Downloaded %s (%d bytes).", filename, written)
+
+    except Exception:
+        logger.exception("❌ Download exception for %s.", filename)
+        tmp.unlink(missing_ok=True)
+
+
+def download_signed_files(
+    files: list[FileView],
+    out_dir: str,
+    timeout_seconds: int,
+    session: requests.Session,
+    concurrency: int = 8,
+) -> None:
     out_path = Path(out_dir)
     out_path.mkdir(parents=True, exist_ok=True)
 
@@ -134,32 +261,56 @@ def download_signed_files(files: list, out_dir: str, timeout_seconds: int) -> No
 
     logger.info("⬇️  Downloading %d file(s) to %s", len(files), out_path.resolve())
 
-    for idx, f in enumerate(files, start=1):
-        signed_url = getattr(f, "signed_url", None) or getattr(f, "download_url", None)
-        filename = getattr(f, "filename", None) or safe_filename_from_url(signed_url or "", f"file_{idx}")
+    # Resolve every destination before fanning out: two workers must never write
+    # the same file, so a repeated signed URL is fetched once and a repeated
+    # filename gets a unique one.
+    jobs: list[tuple[str, str, int | None]] = []
+    seen_urls: set[str] = set()
+    seen_names: set[str] = set()
+    for idx, view in enumerate(files, start=1):
+        signed_url = view.signed_url
+        filename = view.filename or safe_filename_from_url(signed_url or "", f"file_{idx}")
 
         if not signed_url:
             logger.warning("⚠️  Skipping %s (no signed_url).", filename)
             continue
+        if signed_url in seen_urls:
+            logger.info("⏭️  Skipping %s (same signed_url listed twice).", filename)
+            continue
+        if filename in seen_names:
+            base = Path(filename)
+            unique = f"{base.stem}-{view.file_id}{base.suffix}"
+            if unique in seen_names:
+                unique = f"{base.stem}-{view.file_id}-{idx}{base.suffix}"
+            logger.warning("⚠️  %s (file_id=%s) clashes with another file in this batch; saving as %s.",
+                           filename, view.file_id, unique)
+            filename = unique
+
+        seen_urls.add(signed_url)
+        seen_names.add(filename)
+        jobs.append((signed_url, filename, view.size))
+
+    if not jobs:
+        return
 
-        destination = out_path / filename
-        logger.info("➡️  GET %s", signed_url)
-
-        try:
-            resp = requests.get(signed_url, stream=True, timeout=timeout_seconds)
-            if resp.status_code != 200:
-                logger.error("❌ Download failed for %s (HTTP %s).", filename, resp.status_code)
-                continue
-
-            with destination.open("wb") as fp:
-                for chunk in resp.iter_content(chunk_size=1024 * 1024):
-                    if chunk:
-                        fp.write(chunk)
+    # Downloads are network-bound, so a small thread pool over the shared
+    # session overlaps per-file latency instead of summing it.
+    workers = max(1, min(concurrency, len(jobs)))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download")
+    try:
+        futures = [
+            pool.submit(_download_one, session, signed_url, filename, size, out_path, timeout_seconds)
+            for signed_url, filename, size in jobs
+        ]
+        for future in futures:
+            future.result()
+    finally:
+        # On Ctrl-C, drop queued downloads instead of draining the whole batch
+        pool.shutdown(cancel_futures=True)
 
-            logger.info("✅ Downloaded %s (%d bytes).", filename, destination.stat().st_size)
 
-        except Exception:
-            logger.exception("❌ Download exception for %s.", filename)
+# `_request` must keep the SDK's `json=` keyword, which shadows the module there.
+_json_dumps = json.dumps
 
 
 class TracedCrebainClient(CrebainClient):
@@ -174,21 +325,21 @@ class TracedCrebainClient(CrebainClient):
     """
 
     def _request(self, method: str, path: str, params=None, json=None, headers=None):
-        full_url = self.base_url.rstrip("/") + path  # path is like "/v1/entity/submit"
-        logger.info("────────────────────────────────────────────────────────")
-        logger.info("➡️  %s %s", method, full_url)
+        if logger.isEnabledFor(logging.INFO):
+            full_url = self.base_url.rstrip("/") + path  # path is like "/v1/entity/submit"
+            logger.info("────────────────────────────────────────────────────────")
+            logger.info("➡️  %s %s", method, full_url)
 
-        if headers and headers.get("Idempotency-Key"):
-            logger.info("   Idempotency-Key: %s", headers.get("Idempotency-Key"))
+            if headers and headers.get("Idempotency-Key"):
+                logger.info("   Idempotency-Key: %s", headers.get("Idempotency-Key"))
 
-        if json is not None:
-            import json as json_module
-            payload_preview = json_module.dumps(json)[:800]
-            logger.info("   Payload: %s%s", payload_preview, "..." if len(payload_preview) >= 800 else "")
+            if json is not None:
+                serialized = _json_dumps(json)
+                logger.info("   Payload: %.800s%s", serialized, "..." if len(serialized) > 800 else "")
 
-        t0 = time.time()
+        t0 = time.perf_counter_ns()
         data, request_id = super()._request(method, path, params=params, json=json, headers=headers)
-        ms = int((time.time() - t0) * 1000)
+        ms = (time.perf_counter_ns() - t0) // 1_000_000
 
         logger.info("⬅️  OK (%d ms) request_id=%s", ms, request_id)
         return data, request_id
@@ -203,6 +354,8 @@ def run_example() -> None:
 
     # Use traced client so we print the explicit URLs for each request
     client = TracedCrebainClient(api_key=cfg.api_key, base_url=cfg.base_url, supabase_anon_key=cfg.supabase_anon_key)
+    download_session = make_download_session()
+    api_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="api")
 
     target = {
         "external_entity_id": "stenn",
@@ -233,28 +386,33 @@ def run_example() -> None:
         if getattr(result, "async_request_id", None):
             logger.info("   async_request_id=%s", result.async_request_id)
 
+        # STEP 4's sanity check only needs the submit to have landed, so start it
+        # now and let its round trip overlap with the STEP 3 downloads.
+        entities_future = api_pool.submit(client.list_entities, limit=20)
+
         # STEP 2 — Existing files (if any)
         logger.info("\nSTEP 2) Files currently available (if returned)")
-        existing_files = getattr(result, "existing_files", []) or []
+        existing_files = [FileView.of(f) for f in getattr(result, "existing_files", []) or []]
         logger.info("   existing_files=%d", len(existing_files))
 
-        for f in existing_files:
-            fid = getattr(f, "file_id", None) or getattr(f, "id", None) or "unknown"
-            fn = getattr(f, "filename", None) or getattr(f, "name", None) or "unknown"
-            mt = getattr(f, "mime_type", None) or "unknown"
-            surl = getattr(f, "signed_url", None) or getattr(f, "download_url", None)
-
-            logger.info("   - %s | mime=%s | file_id=%s", fn, mt, fid)
-            if surl:
-                logger.info("     signed_url=%s...", surl[:100])
+        for view in existing_files:
+            logger.info("   - %s | mime=%s | file_id=%s", view.filename or "unknown", view.mime_type, view.file_id)
+            if view.signed_url:
+                logger.info("     signed_url=%.100s...", view.signed_url)
 
         # STEP 3 — Download files from signed URLs (optional)
         logger.info("\nSTEP 3) Download available files (if signed URLs exist)")
-        download_signed_files(existing_files, out_dir=cfg.download_dir, timeout_seconds=cfg.timeout_seconds)
+        download_signed_files(
+            existing_files,
+            out_dir=cfg.download_dir,
+            timeout_seconds=cfg.timeout_seconds,
+            session=download_session,
+            concurrency=cfg.download_concurrency,
+        )
 
         # STEP 4 — List entities (sanity check)
         logger.info("\nSTEP 4) List entities (sanity check)")
-        entities_page = client.list_entities(limit=20)
+        entities_page = entities_future.result()
         logger.info("✅ Returned %d entities (showing up to 20)", len(entities_page.entities))
         for e in entities_page.entities:
             eid = getattr(e, "entity_id", None) or getattr(e, "id", None)
@@ -280,6 +438,10 @@ def run_example() -> None:
         logger.exception("⚠️ Unexpected exception")
         raise
 
+    finally:
+        api_pool.shutdown(cancel_futures=True)
+        download_session.close()
+
 
 if __name__ == "__main__":
     run_example()
@@ -2,7 +2,7 @@
 Minimal webhook example for Crebain API.
 
 Usage:
-    1. Install dependencies: pip install flask crebain-client
+    1. Install dependencies: pip install flask waitress crebain-client
     2. Run this server: python test_webhook.py
     3. Expose with ngrok: ngrok http 5000
     4. Register webhook with the ngrok URL
@@ -14,8 +14,19 @@ with your ngrok URL after starting ngrok.
 import os
 import json
 import logging
+import functools
+import hashlib
+import hmac
+import queue
+import threading
 from flask import Flask, request, jsonify
-from crebain_client import CrebainClient, verify_signature
+from crebain_client import CrebainClient
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # optional: pip install orjson for faster event parsing
+    _loads = json.loads
 
 # Configuration - set these via environment variables
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
@@ -23,12 +34,34 @@ CREBAIN_API_KEY = os.getenv("CREBAIN_API_KEY", "")
 CREBAIN_BASE_URL = os.getenv("CREBAIN_BASE_URL", "")
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY", "")
 
+# Key the HMAC once at startup; each request only copies this prototype.
+WEBHOOK_SECRET_BYTES = WEBHOOK_SECRET.encode("utf-8")
+_HMAC_PROTOTYPE = hmac.new(WEBHOOK_SECRET_BYTES, digestmod=hashlib.sha256)
+
 # Logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(message)s")
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Verified events waiting for the background worker
+_QUEUE: queue.Queue = queue.Queue(maxsize=10_000)
+
+
+def _verify(timestamp: str | None, raw_body: bytes, signature: str | None) -> bool:
+    """
+    Same check as crebain_client.verify_signature, but reuses the pre-keyed HMAC
+    instead of re-encoding the secret and redoing the key schedule per request.
+    """
+    if not timestamp or not signature or not signature.startswith("v1="):
+        return False
+
+    mac = _HMAC_PROTOTYPE.copy()
+    mac.update(timestamp.encode("utf-8"))
+    mac.update(b".")
+    mac.update(raw_body)
+    return hmac.compare_digest(mac.hexdigest(), signature[3:])
+
 
 @app.route("/webhook", methods=["POST"])
 def handle_webhook():
@@ -45,19 +78,50 @@ def handle_webhook():
     logger.info("  Signature: %s", signature[:50] + "..." if signature else None)
 
     # Verify signature
-    if not verify_signature(WEBHOOK_SECRET, timestamp, raw_body, signature):
+    if not _verify(timestamp, raw_body, signature):
         logger.error("Invalid signature!")
         return jsonify({"error": "Invalid signature"}), 401
 
     logger.info("  Signature: VALID")
 
-    # Parse and log the event
-    event = request.json
+    # Parse and log the event (from the already-verified raw body, parsed once)
+    try:
+        event = _loads(raw_body)
+    except ValueError:
+        logger.error("Invalid JSON body!")
+        return jsonify({"error": "Invalid JSON"}), 400
+    if not isinstance(event, dict):
+        logger.error("Event body is not a JSON object!")
+        return jsonify({"error": "Event must be a JSON object"}), 400
+
+    # Hand the event off and acknowledge right away; slow downstream work must not
+    # hold the sender's connection open (or trigger a redelivery).
+    try:
+        _QUEUE.put_nowait(event)
+    except queue.Full:
+        logger.error("Event queue full, asking sender to retry")
+        return jsonify({"error": "Busy"}), 503
+
+    logger.info("  Queued for processing")
+    logger.info("=" * 50)
+    return jsonify({"status": "ok"}), 200
+
+
+def process_event(event: dict):
+    """
+    Process a verified webhook event (runs on the background worker).
+
+    Events are only held in memory: the sender already received 200 when an
+    event was queued, so anything still queued is lost on restart and will not
+    be redelivered. For durable processing, persist the event (database, Redis
+    Stream, ...) in handle_webhook before acknowledging it.
+    """
     event_type = event.get("event")
     request_id = event.get("request_id")
     org_id = event.get("org_id")
     kind = event.get("kind")
 
+    logger.info("Processing event")
     logger.info("  Event: %s", event_type)
     logger.info("  Request ID: %s", request_id)
     logger.info("  Org ID: %s", org_id)
@@ -72,8 +136,18 @@ def handle_webhook():
         # 2. Notify your users
         # 3. Trigger downstream processing
 
-    logger.info("=" * 50)
-    return jsonify({"status": "ok"}), 200
+
+def _drain():
+    """Worker loop: pull verified events off the queue and process them one by one."""
+    while True:
+        event = _QUEUE.get()
+        try:
+            process_event(event)
+        except Exception:
+            # Must not raise: an exception here would kill the only worker thread
+            logger.exception("Failed to process event %r", event)
+        finally:
+            _QUEUE.task_done()
 
 
 @app.route("/health", methods=["GET"])
@@ -82,9 +156,15 @@ def health():
     return jsonify({"status": "healthy"}), 200
 
 
+@functools.lru_cache(maxsize=1)
+def _client() -> CrebainClient:
+    """Process-wide client, so repeated calls share one pooled HTTP session."""
+    return CrebainClient(api_key=CREBAIN_API_KEY, base_url=CREBAIN_BASE_URL, supabase_anon_key=SUPABASE_ANON_KEY)
+
+
 def register_webhook(webhook_url: str):
     """Register a webhook with the Crebain API."""
-    client = CrebainClient(api_key=CREBAIN_API_KEY, base_url=CREBAIN_BASE_URL, supabase_anon_key=SUPABASE_ANON_KEY)
+    client = _client()
 
     try:
         webhook = client.create_webhook(
@@ -102,7 +182,7 @@ def register_webhook(webhook_url: str):
 
 def list_webhooks():
     """List all registered webhooks."""
-    client = CrebainClient(api_key=CREBAIN_API_KEY, base_url=CREBAIN_BASE_URL, supabase_anon_key=SUPABASE_ANON_KEY)
+    client = _client()
 
     webhooks = client.list_webhooks()
     logger.info("Registered webhooks:")
@@ -139,4 +219,11 @@ if __name__ == "__main__":
         logger.info("")
         logger.info("To expose publicly, run: ngrok http %d", port)
         logger.info("Then register: python test_webhook.py --register https://xxx.ngrok.io/webhook")
-        app.run(host="0.0.0.0", port=port, debug=True)
+        threading.Thread(target=_drain, name="webhook-worker", daemon=True).start()
+        try:
+            from waitress import serve
+        except ImportError:
+            logger.warning("waitress not installed; using the Flask development server")
+            app.run(host="0.0.0.0", port=port, debug=True)
+        else:
+            serve(app, host="0.0.0.0", port=port, threads=8)